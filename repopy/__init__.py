@@ -5,10 +5,12 @@ from .repository import (
     BackendProtocol,
     RepositoryFactory,
     RepositoryProtocol,
+    create_repository,
 )
 
 __all__ = [
     'BackendProtocol',
     'RepositoryFactory',
     'RepositoryProtocol',
+    'create_repository',
 ]
@@ -1,12 +1,19 @@
 """In-memory generic implementation of the repository protocol"""
 # pylint: disable=missing-function-docstring
 
+from itertools import compress, repeat
+from operator import attrgetter, eq
 from typing import (
+    Any,
     Callable,
+    Dict,
     Generic,
+    Iterable,
     List,
     Mapping,
     Optional,
+    Sequence,
+    Set,
 )
 
 from ..repository import (
@@ -14,74 +21,193 @@ from ..repository import (
     Field,
 )
 
+# Deleting a row from a list is a memmove of the rows after it, which is
+# cheaper than rebuilding every column until a fairly large number of rows
+# are removed at once
+_MAX_IN_PLACE_DELETES = 128
+
 
 class InMemory(Generic[EntityType]):
     """In-memory backend for Repopy. Useful for testing applications without
-    relying on an external database"""
+    relying on an external database
+
+    Records are stored column-wise: alongside the list of stored entities, a
+    dense list of values is kept for every field that has been filtered on, so
+    that matching only has to walk the columns referenced by the filters. Each
+    filter narrows the set of candidate rows, so later filters only compare
+    the rows that are still in the running.
+
+    Fields listed in indexed_fields additionally get a hash index from value to
+    row positions, so equality filters on them only visit the matching rows
+    instead of scanning the whole store
+
+    As the columns and indexes hold copies of the stored field values, query
+    returns copies of the stored entities, so that callers changing the
+    results can't leave them out of date"""
 
     _copy_func: Optional[Callable[[EntityType], EntityType]]
-    _entity_store: List[EntityType]
+    _entities: List[EntityType]
+    _columns: Dict[str, List[Any]]
+    _indexes: Dict[str, Dict[Any, Set[int]]]
 
-    def __init__(self, copy_func: Callable[[EntityType], EntityType]):
+    def __init__(
+            self,
+            copy_func: Callable[[EntityType], EntityType],
+            indexed_fields: Iterable[str] = (),
+        ):
         self._copy_func = copy_func
-        self._entity_store = []
+        self._entities = []
+        self._columns = {field_name: [] for field_name in indexed_fields}
+        self._indexes = {field_name: {} for field_name in indexed_fields}
 
     def add(self, entities: List[EntityType]):
         assert self._copy_func is not None
-        for entity in entities:
-            self._entity_store.append(self._copy_func(entity))
+        self._append(list(map(self._copy_func, entities)))
+
+    def add_owned(self, entities: List[EntityType]):
+        """Store the given entities without copying them first. Only use this
+        when nothing else holds a reference to the entities (e.g. they were
+        freshly created for a bulk load), as changing them afterwards would
+        leave the backend's columns and indexes out of date"""
+        self._append(list(entities))
 
     def query(
         self,
         filters: Mapping[str, Field],
         limit: Optional[int],
     ) -> List[EntityType]:
-        matching_entities = [
-            entity
-            for entity in self._entity_store
-            if self._matches(filters, entity)
-        ]
-
-        if limit is not None and limit < len(matching_entities):
-            return matching_entities[:limit]
-        return matching_entities
+        assert self._copy_func is not None
+        rows = self._matching_rows(filters)
+        if limit is not None and limit < len(rows):
+            rows = rows[:limit]
+        return list(map(self._copy_func, map(self._entities.__getitem__, rows)))
 
     def update(
         self,
         updates: Mapping[str, Field],
         filters: Mapping[str, Field],
     ) -> int:
-        num_updated = 0
-        new_entities = []
-        for entity in self._entity_store:
-            if self._matches(filters, entity):
-                new_entities.append(self._apply_updates(updates, entity))
-                num_updated += 1
-            else:
-                new_entities.append(entity)
-        self._entity_store = new_entities
-        return num_updated
+        assert self._copy_func is not None
+        rows = self._matching_rows(filters)
+        if not rows:
+            return 0
+
+        copy_func = self._copy_func
+        entities = self._entities
+        update_items = tuple(updates.items())
+        for i in rows:
+            new_entity = copy_func(entities[i])
+            for field_name, new_value in update_items:
+                setattr(new_entity, field_name, new_value)
+            entities[i] = new_entity
+
+        columns = self._columns
+        for field_name, new_value in update_items:
+            column = columns.get(field_name)
+            if column is None:
+                continue
+            index = self._indexes.get(field_name)
+            if index is not None:
+                for i in rows:
+                    old_rows = index[column[i]]
+                    old_rows.discard(i)
+                    if not old_rows:
+                        del index[column[i]]
+                index.setdefault(new_value, set()).update(rows)
+            for i in rows:
+                column[i] = new_value
+        return len(rows)
 
     def delete(self, filters: Mapping[str, Field]) -> int:
-        num_deleted = 0
-        new_entities = []
-        for entity in self._entity_store:
-            if self._matches(filters, entity):
-                num_deleted += 1
-            else:
-                new_entities.append(entity)
-        self._entity_store = new_entities
-        return num_deleted
+        rows = self._matching_rows(filters)
+        if not rows:
+            return 0
+
+        stored_lists = [self._entities, *self._columns.values()]
+        if len(rows) <= _MAX_IN_PLACE_DELETES:
+            self._unindex_deleted_rows(rows)
+            for stored_list in stored_lists:
+                for i in reversed(rows):
+                    del stored_list[i]
+        else:
+            keep = [True] * len(self._entities)
+            for i in rows:
+                keep[i] = False
+            for stored_list in stored_lists:
+                stored_list[:] = compress(stored_list, keep)
+
+            # Most rows have moved, so the indexes are rebuilt from the
+            # (already compacted) columns
+            for field_name in self._indexes:
+                index: Dict[Any, Set[int]] = {}
+                for i, value in enumerate(self._columns[field_name]):
+                    index.setdefault(value, set()).add(i)
+                self._indexes[field_name] = index
+        return len(rows)
+
+    def _append(self, new_entities: List[EntityType]):
+        first_row = len(self._entities)
+        self._entities.extend(new_entities)
+        for field_name, column in self._columns.items():
+            column.extend(map(attrgetter(field_name), new_entities))
+        for field_name, index in self._indexes.items():
+            column = self._columns[field_name]
+            for i in range(first_row, len(column)):
+                index.setdefault(column[i], set()).add(i)
+
+    def _unindex_deleted_rows(self, rows: Sequence[int]):
+        """Update the indexes for the given (ascending) rows being deleted in
+        place, before the columns are changed: the deleted rows are removed,
+        and every row after the first deleted one moves down by the number of
+        deleted rows before it"""
+        deleted_rows = set(rows)
+        for field_name, index in self._indexes.items():
+            column = self._columns[field_name]
+            for i in rows:
+                value_rows = index[column[i]]
+                value_rows.discard(i)
+                if not value_rows:
+                    del index[column[i]]
 
-    def _matches(self, filters: Mapping[str, Field], entity: EntityType): # pylint: disable=no-self-use
-        return all([
-            getattr(entity, filter_name) == filter_value
+            # Rows are moved in ascending order, so the position a row moves
+            # to has always been vacated already
+            shift = 0
+            for i in range(rows[0], len(column)):
+                if i in deleted_rows:
+                    shift += 1
+                    continue
+                value_rows = index[column[i]]
+                value_rows.discard(i)
+                value_rows.add(i - shift)
+
+    def _matching_rows(self, filters: Mapping[str, Field]) -> Sequence[int]:
+        indexed_rows = [
+            self._indexes[filter_name].get(filter_value, set())
             for filter_name, filter_value in filters.items()
-        ])
+            if filter_name in self._indexes
+        ]
+        rows: Sequence[int]
+        if indexed_rows:
+            rows = sorted(set.intersection(*indexed_rows))
+        else:
+            rows = range(len(self._entities))
 
-    def _apply_updates(self, updates, entity):
-        assert self._copy_func is not None
-        new_entity = self._copy_func(entity)
-        for field_name, new_value in updates.items():
-            setattr(new_entity, field_name, new_value)
-        return new_entity
+        for filter_name, filter_value in filters.items():
+            if not rows:
+                break
+            if filter_name in self._indexes:
+                continue
+            column = self._column(filter_name)
+            if len(rows) == len(column):
+                values: Iterable[Any] = column
+            else:
+                values = map(column.__getitem__, rows)
+            rows = list(compress(rows, map(eq, values, repeat(filter_value))))
+        return rows
+
+    def _column(self, field_name: str) -> List[Any]:
+        column = self._columns.get(field_name)
+        if column is None:
+            column = list(map(attrgetter(field_name), self._entities))
+            self._columns[field_name] = column
+        return column
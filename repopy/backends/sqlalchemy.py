@@ -1,4 +1,4 @@
-"""In-memory generic implementation of the repository protocol"""
+"""SQLAlchemy generic implementation of the repository protocol"""
 # pylint: disable=missing-function-docstring
 
 from typing import (
@@ -9,11 +9,12 @@ from typing import (
     Mapping,
     Optional,
     Protocol,
+    Tuple,
     Type,
     TypeVar,
 )
 
-from sqlalchemy import Table # type: ignore
+from sqlalchemy import Table, bindparam # type: ignore
 
 from ..repository import (
     EntityType,
@@ -64,10 +65,22 @@ def optional_type_safe_get(
 
 
 class SQLAlchemy(Generic[EntityType]):
-    """SQLAlchemy based backend for RDBMS support"""
+    """SQLAlchemy based backend for RDBMS support
+
+    Records passed to add are inserted in a single executemany call. For
+    PostgreSQL, creating the engine with executemany_mode='values' lets
+    psycopg2 send the whole batch as one multi-row INSERT.
+
+    Statements are built once per combination of filter/update fields, with
+    bind parameters in place of the values, and their compiled form is cached
+    so that repeated calls skip SQL compilation"""
     _codec: Type[DictCodec[EntityType]]
+    _columns: Dict[str, Any]
     _engine: Any
-    _table: Any
+    _meta: Any
+    _reflected_table: Any
+    _statements: Dict[Tuple[Any, ...], Any]
+    _table_name: str
 
     def __init__(
             self,
@@ -77,45 +90,65 @@ class SQLAlchemy(Generic[EntityType]):
             table_name: str,
         ):
         self._codec = codec
-        self._engine = engine
-        self._table = Table(
-            table_name,
-            meta,
-            autoload=True,
-            autoload_with=engine,
-        )
+        self._columns = {}
+        self._engine = engine.execution_options(compiled_cache={})
+        self._meta = meta
+        self._reflected_table = None
+        self._statements = {}
+        self._table_name = table_name
+
+    @property
+    def _table(self) -> Any:
+        # The table schema is only reflected from the database once it is
+        # first needed, so creating a backend doesn't require a connection
+        if self._reflected_table is None:
+            self._reflected_table = Table(
+                self._table_name,
+                self._meta,
+                autoload_with=self._engine,
+            )
+        return self._reflected_table
 
     def add(self, entities: List[EntityType]):
-        conn = self._engine.connect()
-        conn.execute(self._table.insert(None), [
-            self._codec.to_dict(entity)
-            for entity in entities
-        ])
+        if not entities:
+            return
+
+        insert = self._statements.get(('add',))
+        if insert is None:
+            insert = self._table.insert(None)
+            self._statements[('add',)] = insert
+
+        with self._engine.begin() as conn:
+            conn.execute(insert, [
+                self._codec.to_dict(entity)
+                for entity in entities
+            ])
 
     def query(
         self,
         filters: Mapping[str, Field],
         limit: Optional[int],
     ) -> List[EntityType]:
-        conn = self._engine.connect()
-
-        select = self._table.select()
-        if filters:
-            for filter_name, filter_value in filters.items():
-                select = select.where(
-                    getattr(
-                        self._table.c,
-                        self._codec.map_field(filter_name),
-                    ) == filter_value
-                )
+        key = ('query', tuple(filters), limit is not None)
+        select = self._statements.get(key)
+        if select is None:
+            select = self._where(self._table.select(), filters)
+            if limit is not None:
+                select = select.limit(bindparam('limit'))
+            self._statements[key] = select
+
+        params = self._filter_params(filters)
         if limit is not None:
-            select = select.limit(limit)
+            params['limit'] = limit
 
-        results = conn.execute(select)
-        return [
-            self._codec.from_dict(dict(row.items()))
-            for row in results
-        ]
+        with self._engine.connect() as conn:
+            results = conn.execute(select, params)
+            column_names = results.keys()
+            from_dict = self._codec.from_dict
+            return [
+                from_dict(dict(zip(column_names, row)))
+                for row in results
+            ]
 
     def update(
         self,
@@ -125,40 +158,49 @@ class SQLAlchemy(Generic[EntityType]):
         if not updates:
             return 0
 
-        conn = self._engine.connect()
-        update = self._table.update(None).values({
-            getattr(self._table.c, self._codec.map_field(field_name)): new_value
-            for field_name, new_value in updates.items()
-        })
-        if filters:
-            for filter_name, filter_value in filters.items():
-                update = update.where(
-                    getattr(
-                        self._table.c,
-                        self._codec.map_field(filter_name),
-                    ) == filter_value
-                )
-
-        results = conn.execute(update)
-        return results.rowcount
+        key = ('update', tuple(updates), tuple(filters))
+        update = self._statements.get(key)
+        if update is None:
+            update = self._where(self._table.update(None), filters).values({
+                self._column(field_name): bindparam(f'update_{field_name}')
+                for field_name in updates
+            })
+            self._statements[key] = update
+
+        params = self._filter_params(filters)
+        for field_name, new_value in updates.items():
+            params[f'update_{field_name}'] = new_value
+
+        with self._engine.connect() as conn:
+            return conn.execute(update, params).rowcount
 
     def delete(self, filters: Mapping[str, Field]) -> int:
-        conn = self._engine.connect()
-        delete = self._table.delete(None)
-        if filters:
-            for filter_name, filter_value in filters.items():
-                delete = delete.where(
-                    getattr(
-                        self._table.c,
-                        self._codec.map_field(filter_name),
-                    ) == filter_value
-                )
-        results = conn.execute(delete)
-        return results.rowcount
-
-
-def _row2dict(row):
-    data = {}
-    for column in row.__table__.columns:
-        data[column.name] = str(getattr(row, column.name))
-    return data
+        key = ('delete', tuple(filters))
+        delete = self._statements.get(key)
+        if delete is None:
+            delete = self._where(self._table.delete(None), filters)
+            self._statements[key] = delete
+
+        with self._engine.connect() as conn:
+            return conn.execute(delete, self._filter_params(filters)).rowcount
+
+    def _where(self, statement: Any, filters: Mapping[str, Field]) -> Any:
+        for filter_name in filters:
+            statement = statement.where(
+                self._column(filter_name) == bindparam(f'filter_{filter_name}')
+            )
+        return statement
+
+    @staticmethod
+    def _filter_params(filters: Mapping[str, Field]) -> Dict[str, Any]:
+        return {
+            f'filter_{filter_name}': filter_value
+            for filter_name, filter_value in filters.items()
+        }
+
+    def _column(self, field_name: str) -> Any:
+        column = self._columns.get(field_name)
+        if column is None:
+            column = self._table.c[self._codec.map_field(field_name)]
+            self._columns[field_name] = column
+        return column
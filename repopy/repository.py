@@ -1,6 +1,9 @@
 """Top-level classes and protocols for Repopy"""
 
+import sys
+import types
 from datetime import datetime
+from functools import lru_cache
 from typing import (
     Any,
     Dict,
@@ -9,15 +12,22 @@ from typing import (
     Mapping,
     Optional,
     Protocol,
+    Tuple,
     Type,
     TypeVar,
     Union,
     get_args,
+    get_origin,
 )
 
 Field = Union[int, float, bool, str, datetime]
 FIELD_TYPES = (int, float, bool, str, datetime)
 
+_NoneType = type(None)
+# Unions written with the | operator (PEP 604) have their own origin type
+# from Python 3.10
+_UNION_ORIGINS = (Union, getattr(types, 'UnionType', Union))
+
 EntityType = TypeVar('EntityType')
 FilterType = TypeVar('FilterType', contravariant=True)
 UpdatesType = TypeVar('UpdatesType', contravariant=True)
@@ -72,12 +82,14 @@ class BackendProtocol(Protocol, Generic[EntityType]):
 class Repository(Generic[EntityType, FilterType, UpdatesType]):
     """Default implementation of the repopy Repository Protocol"""
 
+    __slots__ = ('_backend', '_field_names')
+
     _backend: BackendProtocol
-    _field_names: List[str]
+    _field_names: Tuple[str, ...]
 
     def __init__(self, backend, field_names):
         self._backend = backend
-        self._field_names = field_names
+        self._field_names = tuple(sys.intern(name) for name in field_names)
 
     def add(self, entities: List[EntityType]):
         """Insert one or more new records into the repository"""
@@ -104,59 +116,89 @@ class Repository(Generic[EntityType, FilterType, UpdatesType]):
     def _to_field_map(self, obj: Any) -> Mapping[str, Field]:
         field_map = {}
         for field_name in self._field_names:
-            if getattr(obj, field_name, None) is not None:
-                field_map[field_name] = getattr(obj, field_name)
+            value = getattr(obj, field_name, None)
+            if value is not None:
+                field_map[field_name] = value
         return field_map
 
 
-class RepositoryFactory(Generic[EntityType, FilterType, UpdatesType]): # pylint: disable=too-few-public-methods
-    """Static methods for creating valid repositories"""
-
-    @staticmethod
-    def create_repository(
-        entity_cls: Type[EntityType],
-        filter_cls: Type[FilterType],
-        updates_cls: Type[UpdatesType],
-        backend: BackendProtocol,
-    ) -> Repository[EntityType, FilterType, UpdatesType]:
-        """Create a new repository with the provided types and backend"""
-        fields: Dict[str, Field] = {}
-        for field_name, field_type in entity_cls.__annotations__.items():
+@lru_cache(maxsize=128)
+def _validate_types(
+    entity_cls: type,
+    filter_cls: type,
+    updates_cls: type,
+) -> Tuple[str, ...]:
+    """Check that the given entity/filter/update types can be used together in
+    a repository, returning the entity's field names. The result is cached per
+    combination of types, so repeated calls for the same types are cheap"""
+    fields: Dict[str, Field] = {}
+    for field_name, field_type in entity_cls.__annotations__.items():
+        type_to_check = field_type
+        if get_origin(field_type) in _UNION_ORIGINS:
             type_args = get_args(field_type)
-            is_optional_type = len(type_args) == 2 and type_args[1] == type(None)
-            if is_optional_type:
-                type_to_check = type_args[0]
-            else:
-                type_to_check = field_type
-
-            if type_to_check not in FIELD_TYPES:
-                raise ValueError(f'Field type "{field_type}" not supported')
-            fields[field_name] = field_type
-
-        for field_name, field_type in filter_cls.__annotations__.items():
-            if field_name not in fields:
-                raise ValueError(
-                    f'Filter type not compatible: field "{field_name}"'
-                    + ' not in entity type'
-                )
-            desired_type = fields[field_name]
-            if field_type not in (desired_type, Optional[desired_type]):
-                raise ValueError(
-                    f'Filter type not compatible: field "{field_name}"'
-                    + f' should have type {desired_type}/{Optional[desired_type]}'
+            if len(type_args) == 2 and _NoneType in type_args:
+                type_to_check = next(
+                    type_arg
+                    for type_arg in type_args
+                    if type_arg is not _NoneType
                 )
 
-        for field_name, field_type in updates_cls.__annotations__.items():
-            if field_name not in fields:
-                raise ValueError(
-                    f'Update type not compatible: field "{field_name}"'
-                    + ' not in entity type'
-                )
-            desired_type = fields[field_name]
-            if field_type not in (desired_type, Optional[desired_type]):
-                raise ValueError(
-                    f'Update type not compatible: field "{field_name}"'
-                    + f' should have type {desired_type}/{Optional[desired_type]}'
-                )
+        if type_to_check not in FIELD_TYPES:
+            raise ValueError(f'Field type "{field_type}" not supported')
+        fields[field_name] = field_type
+
+    # Subscripting Optional goes through typing's (cached, but still costly)
+    # alias machinery, so do it once per entity field rather than for every
+    # filter/update field that is checked
+    allowed_types = {
+        field_name: (field_type, Optional[field_type])
+        for field_name, field_type in fields.items()
+    }
+
+    for field_name, field_type in filter_cls.__annotations__.items():
+        if field_name not in fields:
+            raise ValueError(
+                f'Filter type not compatible: field "{field_name}"'
+                + ' not in entity type'
+            )
+        desired_type, optional_type = allowed_types[field_name]
+        if field_type not in (desired_type, optional_type):
+            raise ValueError(
+                f'Filter type not compatible: field "{field_name}"'
+                + f' should have type {desired_type}/{optional_type}'
+            )
+
+    for field_name, field_type in updates_cls.__annotations__.items():
+        if field_name not in fields:
+            raise ValueError(
+                f'Update type not compatible: field "{field_name}"'
+                + ' not in entity type'
+            )
+        desired_type, optional_type = allowed_types[field_name]
+        if field_type not in (desired_type, optional_type):
+            raise ValueError(
+                f'Update type not compatible: field "{field_name}"'
+                + f' should have type {desired_type}/{optional_type}'
+            )
+
+    return tuple(fields)
+
+
+def create_repository(
+    entity_cls: Type[EntityType],
+    filter_cls: Type[FilterType],
+    updates_cls: Type[UpdatesType],
+    backend: BackendProtocol,
+) -> Repository[EntityType, FilterType, UpdatesType]:
+    """Create a new repository with the provided types and backend"""
+    # lru_cache only accepts Hashable arguments, which mypy can't prove
+    # for generic class objects
+    field_names = _validate_types(entity_cls, filter_cls, updates_cls) # type: ignore[arg-type]
+    return Repository(backend, field_names)
+
+
+class RepositoryFactory(Generic[EntityType, FilterType, UpdatesType]): # pylint: disable=too-few-public-methods
+    """Static methods for creating valid repositories (kept for backwards
+    compatibility, new code can call create_repository directly)"""
 
-        return Repository(backend, list(fields.keys()))
+    create_repository = staticmethod(create_repository)
@@ -0,0 +1,6 @@
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers',
+        'sqlalchemy_backend: tests that need a database at DATABASE_URL'
+        + ' (deselect with -m "not sqlalchemy_backend")',
+    )
@@ -1,13 +1,12 @@
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Any, Dict, Optional, Type, TypeVar
-import dataclasses
 import os
 
 import pytest # type: ignore
 from sqlalchemy import create_engine, MetaData # type: ignore
 
-from repopy import BackendProtocol, RepositoryFactory
+from repopy import BackendProtocol, RepositoryFactory, RepositoryProtocol
 from repopy.backends import InMemory, SQLAlchemy
 from repopy.backends.sqlalchemy import optional_type_safe_get, type_safe_get
 
@@ -29,43 +28,82 @@ class PersonUpdate:
     name: Optional[str] = None
 
 
-def setup_in_memory_backend() -> BackendProtocol[Person]:
-    def copy_func(person: Person) -> Person:
-        return Person(**dataclasses.asdict(person))
-    return InMemory(copy_func)
-
-def setup_sqlalchemy_backend() -> BackendProtocol[Person]:
-    class PersonCodec:
-        @staticmethod
-        def to_dict(person: Person) -> Dict[str, Any]:
-            return {
-                'id': person.person_id,
-                'full_name': person.name,
-                'age': person.age,
-                'soft_deleted_at': person.soft_deleted_at,
-            }
-
-        @staticmethod
-        def from_dict(data: Dict[str, Any]) -> Person:
-            return Person(
-                person_id=type_safe_get(data, 'id', str),
-                name=type_safe_get(data, 'full_name', str),
-                age=type_safe_get(data, 'age', int),
-                soft_deleted_at=optional_type_safe_get(
-                    data,
-                    'soft_deleted_at',
-                    datetime,
-                ),
-            )
-
-        @staticmethod
-        def map_field(field_name: str) -> str:
-            if field_name == 'person_id':
-                return 'id'
-            elif field_name == 'name':
-                return 'full_name'
-            return field_name
+# Number of records the tests below insert for each age group, must be at
+# least 2 so that the limit tests can query for fewer records than exist
+N_PER_GROUP = 10
 
+# Records shared by the tests below, the first N_PER_GROUP are 25 yrs old and
+# the rest are 50. Backends copy the records they're given so these are never
+# changed by a test
+SAMPLE_PERSONS = tuple(
+    Person(
+        person_id=f'person-{i}',
+        name=f'name-{i}',
+        age=25 if i < N_PER_GROUP else 50,
+    )
+    for i in range(0, 2 * N_PER_GROUP)
+)
+
+# Filters shared by the tests below, the repository only ever reads them
+FILTER_AGE_25 = PersonFilter(age=25)
+FILTER_AGE_50 = PersonFilter(age=50)
+
+PersonRepository = RepositoryProtocol[Person, PersonFilter, PersonUpdate]
+
+
+class PersonCodec:
+    @staticmethod
+    def to_dict(person: Person) -> Dict[str, Any]:
+        return {
+            'id': person.person_id,
+            'full_name': person.name,
+            'age': person.age,
+            'soft_deleted_at': person.soft_deleted_at,
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> Person:
+        return Person(
+            person_id=type_safe_get(data, 'id', str),
+            name=type_safe_get(data, 'full_name', str),
+            age=type_safe_get(data, 'age', int),
+            soft_deleted_at=optional_type_safe_get(
+                data,
+                'soft_deleted_at',
+                datetime,
+            ),
+        )
+
+    @staticmethod
+    def map_field(field_name: str) -> str:
+        if field_name == 'person_id':
+            return 'id'
+        elif field_name == 'name':
+            return 'full_name'
+        return field_name
+
+
+def copy_person(person: Person) -> Person:
+    return Person(
+        person.person_id,
+        person.name,
+        person.age,
+        person.soft_deleted_at,
+    )
+
+
+@pytest.fixture
+def in_memory_backend() -> BackendProtocol[Person]:
+    return InMemory(copy_person)
+
+@pytest.fixture
+def indexed_in_memory_backend() -> BackendProtocol[Person]:
+    return InMemory(copy_person, indexed_fields=['name', 'age'])
+
+@pytest.fixture(scope='module')
+def sqlalchemy_engine():
+    # The engine and schema are shared by every test in the module, each
+    # test's records are cleared out by the sqlalchemy_backend fixture
     database_url = os.environ['DATABASE_URL']
     engine = create_engine(database_url)
     with engine.connect() as conn:
@@ -78,115 +116,84 @@ def setup_sqlalchemy_backend() -> BackendProtocol[Person]:
             soft_deleted_at TIMESTAMP
         );
         """)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture(scope='module')
+def sqlalchemy_meta():
+    return MetaData()
 
-    meta = MetaData()
-    return SQLAlchemy(
+@pytest.fixture
+def sqlalchemy_backend(sqlalchemy_engine, sqlalchemy_meta):
+    yield SQLAlchemy(
         PersonCodec,
-        meta,
-        engine,
+        sqlalchemy_meta,
+        sqlalchemy_engine,
         'person',
     )
-
-@pytest.fixture(params=[setup_in_memory_backend, setup_sqlalchemy_backend])
+    with sqlalchemy_engine.connect() as conn:
+        conn.execute('DELETE FROM person')
+
+@pytest.fixture(params=[
+    'in_memory_backend',
+    'indexed_in_memory_backend',
+    pytest.param('sqlalchemy_backend', marks=pytest.mark.sqlalchemy_backend),
+])
 def backend(request):
-    return request.param()
-
+    return request.getfixturevalue(request.param)
 
-def test_add(backend: BackendProtocol[Person]):
-    # Given a repository
-    person_repository = RepositoryFactory.create_repository(
+@pytest.fixture
+def person_repository(backend: BackendProtocol[Person]) -> PersonRepository:
+    return RepositoryFactory.create_repository(
         Person,
         PersonFilter,
         PersonUpdate,
         backend,
     )
 
-    # And several test records
-    persons = []
-    for i in range(0, 5):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=50,
-        )
-        persons.append(test_person)
+
+def test_add(person_repository: PersonRepository):
+    # Given a repository and several test records
+    persons = list(SAMPLE_PERSONS[N_PER_GROUP:])
 
     # When add is called
     person_repository.add(persons)
 
     # Then all inserted records should be returned when queried
-    queried_persons = person_repository.query(PersonFilter(
-        age=50,
-    ))
+    queried_persons = person_repository.query(FILTER_AGE_50)
 
-    assert len(queried_persons) == 5, \
+    assert len(queried_persons) == N_PER_GROUP, \
         "Expected all inserted records to be returned"
+    queried_by_id = {person.person_id: person for person in queried_persons}
     for person in persons:
-        assert person in queried_persons, \
-            'Expected "{person.person_id}" to have been stored, but it wasn\'t'
+        assert queried_by_id.get(person.person_id) == person, \
+            f'Expected "{person.person_id}" to have been stored, but it wasn\'t'
 
 
-def test_query(backend: BackendProtocol[Person]):
-    # Given a repository
-    person_repository = RepositoryFactory.create_repository(
-        Person,
-        PersonFilter,
-        PersonUpdate,
-        backend,
-    )
-
-    # In which several records have been inserted
-    test_persons = []
-    for i in range(0, 10):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=25, # 25 yrs old
-        )
-        person_repository.add([test_person])
-        test_persons.append(test_person)
+def test_query(person_repository: PersonRepository):
+    # Given a repository in which several records have been inserted
+    test_persons = list(SAMPLE_PERSONS)
 
-    for i in range(10, 20):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=50 # 50 yrs old,
-        )
-        person_repository.add([test_person])
-        test_persons.append(test_person)
+    person_repository.add(test_persons)
 
     # When a subset of records are queried
-    queried_persons = person_repository.query(PersonFilter(
-        age=50,
-    ))
+    queried_persons = person_repository.query(FILTER_AGE_50)
 
     # Then those records, and only those records, should be returned
-    assert len(queried_persons) == 10, \
-        f'Expected 10 records to be returned, got {len(queried_persons)}'
-    for person in test_persons[10:]:
-        assert person in queried_persons, \
+    assert len(queried_persons) == N_PER_GROUP, \
+        f'Expected {N_PER_GROUP} records to be returned, ' \
+        f'got {len(queried_persons)}'
+    queried_by_id = {person.person_id: person for person in queried_persons}
+    for person in test_persons[N_PER_GROUP:]:
+        assert queried_by_id.get(person.person_id) == person, \
             f'Expected "{person.person_id}" to be in results, but it wasn\'t'
 
 
-def test_query_multiple_filters(backend: BackendProtocol[Person]):
-    # Given a repository
-    person_repository = RepositoryFactory.create_repository(
-        Person,
-        PersonFilter,
-        PersonUpdate,
-        backend,
-    )
+def test_query_multiple_filters(person_repository: PersonRepository):
+    # Given a repository in which several records have been inserted
+    test_persons = list(SAMPLE_PERSONS[:N_PER_GROUP])
 
-    # In which several records have been inserted
-    test_persons = []
-    for i in range(0, 10):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=25, # 25 yrs old
-        )
-        person_repository.add([test_person])
-        test_persons.append(test_person)
+    person_repository.add(test_persons)
 
     # When a record is queried with multiple filters
     queried_persons = person_repository.query(PersonFilter(
@@ -199,145 +206,79 @@ def test_query_multiple_filters(backend: BackendProtocol[Person]):
     assert queried_persons[0].person_id == 'person-0'
 
 
-def test_query_obeys_limit(backend: BackendProtocol[Person]):
-    # Given a repository
-    person_repository = RepositoryFactory.create_repository(
-        Person,
-        PersonFilter,
-        PersonUpdate,
-        backend,
-    )
+def test_query_obeys_limit(person_repository: PersonRepository):
+    # Given a repository in which several records have been inserted
+    test_persons = list(SAMPLE_PERSONS[:N_PER_GROUP])
 
-    # In which several records have been inserted
-    test_persons = []
-    for i in range(0, 10):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=25, # 25 yrs old
-        )
-        person_repository.add([test_person])
-        test_persons.append(test_person)
+    person_repository.add(test_persons)
 
     # When queried with a limit < the number of records
-    queried_persons = person_repository.query(PersonFilter(), limit=5)
+    limit = N_PER_GROUP // 2
+    queried_persons = person_repository.query(PersonFilter(), limit=limit)
 
     # Then the number of records returned should be equal to the limit
-    assert len(queried_persons) == 5, \
-        f'Expected 5 records to be returned, got {len(queried_persons)}'
+    assert len(queried_persons) == limit, \
+        f'Expected {limit} records to be returned, got {len(queried_persons)}'
 
 
-def test_query_handles_large_limit(backend: BackendProtocol[Person]):
-    # Given a repository
-    person_repository = RepositoryFactory.create_repository(
-        Person,
-        PersonFilter,
-        PersonUpdate,
-        backend,
-    )
+def test_query_handles_large_limit(person_repository: PersonRepository):
+    # Given a repository in which several records have been inserted
+    test_persons = list(SAMPLE_PERSONS[:N_PER_GROUP])
 
-    # In which several records have been inserted
-    test_persons = []
-    for i in range(0, 10):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=25, # 25 yrs old
-        )
-        person_repository.add([test_person])
-        test_persons.append(test_person)
+    person_repository.add(test_persons)
 
     # When queried with a limit > the number of records
-    queried_persons = person_repository.query(PersonFilter(), limit=50)
+    queried_persons = person_repository.query(
+        PersonFilter(),
+        limit=5 * N_PER_GROUP,
+    )
 
     # Then the number of records returned should be equal to the total
     # number of records
-    assert len(queried_persons) == 10, \
-        f'Expected 10 records to be returned, got {len(queried_persons)}'
+    assert len(queried_persons) == N_PER_GROUP, \
+        f'Expected {N_PER_GROUP} records to be returned, ' \
+        f'got {len(queried_persons)}'
 
 
-def test_update(backend: BackendProtocol[Person]):
-    # Given a repository
-    person_repository = RepositoryFactory.create_repository(
-        Person,
-        PersonFilter,
-        PersonUpdate,
-        backend,
-    )
-
-    # In which several records have been inserted
-    test_persons = []
-    for i in range(0, 10):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=25, # 25 yrs old
-        )
-        person_repository.add([test_person])
-        test_persons.append(test_person)
+def test_update(person_repository: PersonRepository):
+    # Given a repository in which several records have been inserted
+    test_persons = list(SAMPLE_PERSONS)
 
-    for i in range(10, 20):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=50, # 50 yrs old
-        )
-        person_repository.add([test_person])
-        test_persons.append(test_person)
+    person_repository.add(test_persons)
 
     # When some of them are updated
     num_updated = person_repository.update(
         PersonUpdate(
             name='new-name',
         ),
-        PersonFilter(
-            age=25,
-        ),
+        FILTER_AGE_25,
     )
 
     # Then the count of updated records should be correct
-    assert num_updated == 10
+    assert num_updated == N_PER_GROUP
 
     # And the records that match the update should have been changed
-    updated_records = person_repository.query(PersonFilter(
-        age=25,
-    ))
-    assert len(updated_records) == 10
-    assert all([
+    updated_records = person_repository.query(FILTER_AGE_25)
+    assert len(updated_records) == N_PER_GROUP
+    assert all(
         person.name == 'new-name'
         for person in updated_records
-    ]), 'All matching records should have been updated'
+    ), 'All matching records should have been updated'
 
     # And those that don't should be unaltered
-    not_updated_records = person_repository.query(PersonFilter(
-        age=50,
-    ))
-    assert len(not_updated_records) == 10
-    assert all([
+    not_updated_records = person_repository.query(FILTER_AGE_50)
+    assert len(not_updated_records) == N_PER_GROUP
+    assert all(
         person.name != 'new-name'
         for person in not_updated_records
-    ]), 'Non-matching records should be unaltered'
+    ), 'Non-matching records should be unaltered'
 
 
-def test_update_multiple_filters(backend: BackendProtocol[Person]):
-    # Given a repository
-    person_repository = RepositoryFactory.create_repository(
-        Person,
-        PersonFilter,
-        PersonUpdate,
-        backend,
-    )
+def test_update_multiple_filters(person_repository: PersonRepository):
+    # Given a repository in which several records have been inserted
+    test_persons = list(SAMPLE_PERSONS[:N_PER_GROUP])
 
-    # In which several records have been inserted
-    test_persons = []
-    for i in range(0, 10):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=25, # 25 yrs old
-        )
-        person_repository.add([test_person])
-        test_persons.append(test_person)
+    person_repository.add(test_persons)
 
     # When one of them is updated via multiple filters
     num_updated = person_repository.update(
@@ -361,76 +302,33 @@ def test_update_multiple_filters(backend: BackendProtocol[Person]):
     assert updated_persons[0].person_id == 'person-0'
 
 
-def test_delete(backend: BackendProtocol[Person]):
-    # Given a repository
-    person_repository = RepositoryFactory.create_repository(
-        Person,
-        PersonFilter,
-        PersonUpdate,
-        backend,
-    )
-
-    # In which several records have been inserted
-    test_persons = []
-    for i in range(0, 10):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=25, # 25 yrs old
-        )
-        person_repository.add([test_person])
-        test_persons.append(test_person)
+def test_delete(person_repository: PersonRepository):
+    # Given a repository in which several records have been inserted
+    test_persons = list(SAMPLE_PERSONS)
 
-    for i in range(10, 20):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=50, # 50 yrs old
-        )
-        person_repository.add([test_person])
-        test_persons.append(test_person)
+    person_repository.add(test_persons)
 
     # When some of them are deleted
     num_deleted = person_repository.delete(
-        PersonFilter(
-            age=25,
-        ),
+        FILTER_AGE_25,
     )
 
     # Then the count of deleted records should be correct
-    assert num_deleted == 10
+    assert num_deleted == N_PER_GROUP
 
     # And the records that match the update should have been removed
-    deleted_records = person_repository.query(PersonFilter(
-        age=25,
-    ))
+    deleted_records = person_repository.query(FILTER_AGE_25)
     assert len(deleted_records) == 0
 
     # And those that don't should be left
-    not_deleted_records = person_repository.query(PersonFilter(
-        age=50,
-    ))
-    assert len(not_deleted_records) == 10
+    not_deleted_records = person_repository.query(FILTER_AGE_50)
+    assert len(not_deleted_records) == N_PER_GROUP
 
-def test_delete_multiple_filters(backend: BackendProtocol[Person]):
-    # Given a repository
-    person_repository = RepositoryFactory.create_repository(
-        Person,
-        PersonFilter,
-        PersonUpdate,
-        backend,
-    )
+def test_delete_multiple_filters(person_repository: PersonRepository):
+    # Given a repository in which several records have been inserted
+    test_persons = list(SAMPLE_PERSONS[:N_PER_GROUP])
 
-    # In which several records have been inserted
-    test_persons = []
-    for i in range(0, 10):
-        test_person = Person(
-            person_id=f'person-{i}',
-            name=f'name-{i}',
-            age=25, # 25 yrs old
-        )
-        person_repository.add([test_person])
-        test_persons.append(test_person)
+    person_repository.add(test_persons)
 
     # When a specific record is deleted with multiple filters
     num_deleted = person_repository.delete(
@@ -448,16 +346,72 @@ def test_delete_multiple_filters(backend: BackendProtocol[Person]):
     assert len(queried_persons) == 0
 
 
-def test_datetime_supported(backend: BackendProtocol[Person]):
-    # Given a repository
-    person_repository = RepositoryFactory.create_repository(
-        Person,
-        PersonFilter,
-        PersonUpdate,
-        backend,
-    )
+# Fewer and more records than the in-memory backend deletes in place, so that
+# both of its delete paths are covered
+@pytest.mark.parametrize('num_records', [40, 400], ids=['in_place', 'compacted'])
+def test_delete_many(person_repository: PersonRepository, num_records: int):
+    # Given a repository in which many records have been inserted, with the
+    # two age groups interleaved
+    test_persons = [
+        Person(
+            person_id=f'person-{i}',
+            name=f'name-{i}',
+            age=25 if i % 2 == 0 else 50,
+        )
+        for i in range(0, num_records)
+    ]
+    person_repository.add(test_persons)
+
+    # When one of the age groups is deleted
+    num_deleted = person_repository.delete(FILTER_AGE_25)
+
+    # Then the count of deleted records should be correct
+    assert num_deleted == num_records // 2
+
+    # And only the records that don't match should be left
+    assert person_repository.query(FILTER_AGE_25) == []
+    not_deleted_records = person_repository.query(FILTER_AGE_50)
+    assert len(not_deleted_records) == num_records // 2
+    not_deleted_by_id = {
+        person.person_id: person
+        for person in not_deleted_records
+    }
+    for person in test_persons[1::2]:
+        assert not_deleted_by_id.get(person.person_id) == person, \
+            f'Expected "{person.person_id}" to be left, but it wasn\'t'
+
+    # And the remaining records should still be found by name
+    last_person = test_persons[-1]
+    assert person_repository.query(PersonFilter(name='name-0')) == []
+    assert person_repository.query(PersonFilter(name=last_person.name)) == \
+        [last_person]
+    assert person_repository.query(PersonFilter(name='name-1', age=50)) == \
+        [test_persons[1]]
+
+
+def test_changing_query_results_does_not_change_stored_records(
+        person_repository: PersonRepository,
+    ):
+    # Given a repository in which several records have been inserted
+    person_repository.add(list(SAMPLE_PERSONS))
+
+    # When a queried record is changed without going through update
+    queried_persons = person_repository.query(PersonFilter(name='name-0'))
+    assert len(queried_persons) == 1
+    queried_persons[0].name = 'new-name'
+    queried_persons[0].age = 99
 
-    # In which a record with a datetime field has been inserted
+    # Then the stored record should be unaltered
+    assert person_repository.query(PersonFilter(name='new-name')) == []
+    assert person_repository.query(PersonFilter(age=99)) == []
+    queried_persons = person_repository.query(PersonFilter(name='name-0'))
+    assert queried_persons == [SAMPLE_PERSONS[0]]
+    assert len(person_repository.query(FILTER_AGE_25)) == N_PER_GROUP
+
+
+def test_datetime_supported(person_repository: PersonRepository):
+    # Given a repository in which a record with a datetime field has been
+    # inserted
     test_date = datetime.strptime('01/01/2021 13:00:00', "%d/%m/%Y %H:%M:%S")
     test_person = Person(
         person_id='person-0',
@@ -477,3 +431,32 @@ def test_datetime_supported(backend: BackendProtocol[Person]):
     queried_person = queried_persons[0]
 
     assert queried_person.soft_deleted_at == test_date
+
+
+def test_in_memory_add_owned():
+    # Given a repository with an in-memory backend
+    copied_ids = []
+    def recording_copy_person(person: Person) -> Person:
+        copied_ids.append(person.person_id)
+        return copy_person(person)
+
+    backend: InMemory[Person] = InMemory(recording_copy_person)
+    person_repository = RepositoryFactory.create_repository(
+        Person,
+        PersonFilter,
+        PersonUpdate,
+        backend,
+    )
+
+    # When records are handed over to the backend without being copied
+    persons = [
+        Person(person_id=f'person-{i}', name=f'name-{i}', age=50)
+        for i in range(0, 5)
+    ]
+    backend.add_owned(persons)
+
+    # Then they should be stored as-is
+    assert copied_ids == [], \
+        f'Expected no records to be copied, but {copied_ids} were'
+    queried_persons = person_repository.query(FILTER_AGE_50)
+    assert queried_persons == persons
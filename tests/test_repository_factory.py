@@ -1,10 +1,10 @@
-import dataclasses
 from dataclasses import dataclass
-from typing import Dict, Optional
+import sys
+from typing import Dict, List, Optional, Union
 
 import pytest # type: ignore
 
-from repopy import BackendProtocol, RepositoryFactory
+from repopy import BackendProtocol, RepositoryFactory, create_repository
 from repopy.backends import InMemory
 
 
@@ -37,16 +37,96 @@ class SomeTypeUpdate:
     count: Optional[int]
 
 
+@dataclass
+class OptionalFieldsType:
+    count: Optional[int]
+    other_count: Union[None, int]
+
+
+OPTIONAL_FIELDS_TYPES: List[type] = [OptionalFieldsType]
+
+if sys.version_info >= (3, 10):
+    @dataclass
+    class PEP604OptionalFieldsType:
+        count: int | None
+        other_count: None | int
+
+    OPTIONAL_FIELDS_TYPES.append(PEP604OptionalFieldsType)
+
+
+@dataclass
+class BadFilterBogusField:
+    not_count: Optional[int]
+
+
+@dataclass
+class BadFilterWrongType:
+    count: Optional[bool]
+
+
+@dataclass
+class BadUpdateBogusField:
+    not_count: Optional[int]
+
+
+@dataclass
+class BadUpdateWrongType:
+    count: Optional[bool]
+
+
+EXPECTED_UNSUPPORTED_FIELD_TYPE = \
+    'Field type "typing.Dict[str, str]" not supported'
+EXPECTED_FILTER_BOGUS_FIELD = \
+    'Filter type not compatible: field "not_count" not in entity type'
+EXPECTED_FILTER_WRONG_TYPE = (
+    'Filter type not compatible: field "count" should have type '
+    + '<class \'int\'>/typing.Union[int, NoneType]'
+)
+EXPECTED_UPDATE_BOGUS_FIELD = \
+    'Update type not compatible: field "not_count" not in entity type'
+EXPECTED_UPDATE_WRONG_TYPE = (
+    'Update type not compatible: field "count" should have type '
+    + '<class \'int\'>/typing.Union[int, NoneType]'
+)
+
+
 def setup_in_memory_backend() -> BackendProtocol[SomeType]:
     def copy_func(entity: SomeType) -> SomeType:
-        return SomeType(**dataclasses.asdict(entity))
+        return SomeType(entity.id, entity.count)
     return InMemory(copy_func)
 
 
-@pytest.fixture(params=[setup_in_memory_backend])
-def backend(request):
+@pytest.fixture(
+    scope='module',
+    params=[setup_in_memory_backend],
+    ids=['in_memory_backend'],
+)
+def shared_backend(request):
+    # Built once for the module, tests get it through the backend fixture
     return request.param()
 
+@pytest.fixture
+def backend(shared_backend):
+    # Delete any records a test stored in the shared backend once it finishes
+    yield shared_backend
+    shared_backend.delete({})
+
+
+def test_create_repository_function(backend: BackendProtocol[SomeType]):
+    # When a repository is created with the module-level factory function
+    repository = create_repository(
+        SomeType,
+        SomeTypeFilter,
+        SomeTypeUpdate,
+        backend,
+    )
+
+    # Then it should be usable
+    repository.add([SomeType(id='some-id', count=1)])
+    assert repository.query(SomeTypeFilter(count=1)) == [
+        SomeType(id='some-id', count=1),
+    ]
+
 
 def test_unsupported_field_type(backend: BackendProtocol[BadType]):
     with pytest.raises(ValueError) as e:
@@ -57,15 +137,36 @@ def test_unsupported_field_type(backend: BackendProtocol[BadType]):
             backend,
         )
 
-    assert str(e.value) == 'Field type "typing.Dict[str, str]" not supported'
+    assert str(e.value) == EXPECTED_UNSUPPORTED_FIELD_TYPE
 
 
-def test_incompatible_filter_type(backend: BackendProtocol[SomeType]):
-    # When a repository is created with a filter field not in the entity type
-    @dataclass
-    class BadFilterBogusField:
-        not_count: Optional[int]
+@pytest.mark.parametrize(
+    'entity_cls',
+    OPTIONAL_FIELDS_TYPES,
+    ids=[entity_cls.__name__ for entity_cls in OPTIONAL_FIELDS_TYPES],
+)
+def test_optional_field_type_in_either_order(entity_cls):
+    # When a repository is created for an entity type with optional fields
+    # written in either order
+    def copy_func(entity):
+        return entity_cls(entity.count, entity.other_count)
 
+    repository = RepositoryFactory.create_repository(
+        entity_cls,
+        SomeTypeFilter,
+        SomeTypeUpdate,
+        InMemory(copy_func),
+    )
+
+    # Then the field types should be accepted, and the repository usable
+    repository.add([entity_cls(count=1, other_count=None)])
+    assert repository.query(SomeTypeFilter(count=1)) == [
+        entity_cls(count=1, other_count=None),
+    ]
+
+
+def test_incompatible_filter_bogus_field(backend: BackendProtocol[SomeType]):
+    # When a repository is created with a filter field not in the entity type
     with pytest.raises(ValueError) as e:
         RepositoryFactory.create_repository(
             SomeType,
@@ -75,15 +176,12 @@ def test_incompatible_filter_type(backend: BackendProtocol[SomeType]):
         )
 
     # Then a ValueError should be raised
-    assert str(e.value) == \
-        'Filter type not compatible: field "not_count" not in entity type'
+    assert str(e.value) == EXPECTED_FILTER_BOGUS_FIELD
+
 
+def test_incompatible_filter_wrong_type(backend: BackendProtocol[SomeType]):
     # When a repository is created with a filter field with a type that does
     # not match the field in the entity type
-    @dataclass
-    class BadFilterWrongType:
-        count: Optional[bool]
-
     with pytest.raises(ValueError) as e:
         RepositoryFactory.create_repository(
             SomeType,
@@ -93,19 +191,11 @@ def test_incompatible_filter_type(backend: BackendProtocol[SomeType]):
         )
 
     # Then a ValueError should be raised
-    assert str(e.value) == \
-        (
-            'Filter type not compatible: field "count" should have type '
-            + '<class \'int\'>/typing.Union[int, NoneType]'
-        )
+    assert str(e.value) == EXPECTED_FILTER_WRONG_TYPE
 
 
-def test_incompatible_update_type(backend: BackendProtocol[SomeType]):
+def test_incompatible_update_bogus_field(backend: BackendProtocol[SomeType]):
     # When a repository is created with an update field not in the entity type
-    @dataclass
-    class BadUpdateBogusField:
-        not_count: Optional[int]
-
     with pytest.raises(ValueError) as e:
         RepositoryFactory.create_repository(
             SomeType,
@@ -115,15 +205,12 @@ def test_incompatible_update_type(backend: BackendProtocol[SomeType]):
         )
 
     # Then a ValueError should be raised
-    assert str(e.value) == \
-        'Update type not compatible: field "not_count" not in entity type'
+    assert str(e.value) == EXPECTED_UPDATE_BOGUS_FIELD
 
-    # When a repository is created with a filter field with a type that does
-    # not match the field in the entity type
-    @dataclass
-    class BadUpdateWrongType:
-        count: Optional[bool]
 
+def test_incompatible_update_wrong_type(backend: BackendProtocol[SomeType]):
+    # When a repository is created with an update field with a type that does
+    # not match the field in the entity type
     with pytest.raises(ValueError) as e:
         RepositoryFactory.create_repository(
             SomeType,
@@ -133,8 +220,4 @@ def test_incompatible_update_type(backend: BackendProtocol[SomeType]):
         )
 
     # Then a ValueError should be raised
-    assert str(e.value) == \
-        (
-            'Update type not compatible: field "count" should have type '
-            + '<class \'int\'>/typing.Union[int, NoneType]'
-        )
+    assert str(e.value) == EXPECTED_UPDATE_WRONG_TYPE